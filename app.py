@@ -1,11 +1,13 @@
-import base64
+import asyncio
+import binascii
 import os
 import contextlib
 import logging
 from typing import Optional
 
+import pybase64
 import uvicorn
-from fastapi import FastAPI, Header, HTTPException, Request, BackgroundTasks
+from fastapi import FastAPI, Header, HTTPException, Query, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
@@ -23,21 +25,25 @@ from detect import detector
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup Logic
+    # Bound concurrent ensemble batches so requests queue here instead of starving the threadpool
+    app.state.gpu_sem = asyncio.Semaphore(int(os.getenv("GPU_SLOTS", "2")))
+    
     logger.info("--- Warming up the AI engine... ---")
     try:
-        # Trigger model loading in a threadpool so it doesn't block startup completely if async
-        # But here we want to block until ready.
-        # Run a dummy inference to ensure weights are on device
-        dummy_audio = b'\x00' * 16000 # 1 sec silent
-        await run_in_threadpool(detector.analyze_audio, dummy_audio, "English")
+        # Block startup until a silent forward pass through every model has put weights on device
+        await run_in_threadpool(detector.warmup)
         logger.info("--- AI Engine Ready & Warmed Up! ---")
     except Exception as e:
         logger.error(f"Warmup failed: {e}")
     
+    # Coalesce concurrent requests into batched forward passes
+    detector.start_batcher(app.state.gpu_sem)
+    
     yield
     
     # Shutdown Logic
     logger.info("--- Shutting down AudioShield ---")
+    await detector.stop_batcher()
 
 app = FastAPI(
     title="AudioShield AI: Voice Fraud Detector",
@@ -50,6 +56,11 @@ app = FastAPI(
 # Default key from problem statement example: sk_test_123456789
 VALID_API_KEY = os.getenv("API_KEY", "sk_test_123456789")
 
+# Largest accepted MP3 upload (default 10 MB); the base64 limit is derived from it,
+# with headroom for line-wrapped input (CRLF every 76 chars)
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
+MAX_BASE64_LENGTH = 4 * ((MAX_AUDIO_BYTES + 2) // 3) * 78 // 76 + 2
+
 # MODELS (Strict Adherence to Spec)
 class VoiceDetectionRequest(BaseModel):
     language: str = Field(..., description="Language: Tamil, English, Hindi, Malayalam, Telugu")
@@ -63,7 +74,36 @@ class VoiceDetectionResponse(BaseModel):
     confidenceScore: float
     explanation: str
 
+def decode_base64(payload: bytes) -> bytes:
+    """Strict SIMD fast path first; on failure retry leniently (e.g. line-wrapped `base64` output)."""
+    try:
+        return pybase64.b64decode(payload, validate=True)
+    except binascii.Error:
+        return pybase64.b64decode(payload, validate=False)
+
 # ROUTES
+async def run_detection(audio_data: bytes, language: str) -> VoiceDetectionResponse:
+    """Shared detection step for the base64 and raw routes; raises ValueError on analysis failure."""
+    # Decode runs in a worker thread; inference is micro-batched with other
+    # in-flight requests, and the semaphore caps concurrent GPU batches.
+    logger.info(f"Processing request for language: {language}")
+    
+    result = await detector.analyze_audio_batched(audio_data, language)
+
+    if "error" in result:
+         # If internal analysis failed, we still want to return a strict error format if possible,
+         # or map it to the error response.
+         raise ValueError(result["error"])
+
+    # Return formatted response (Strict JSON)
+    return VoiceDetectionResponse(
+        status="success",
+        language=language,
+        classification=result["classification"],
+        confidenceScore=result["confidenceScore"],
+        explanation=result["explanation"]
+    )
+
 @app.post("/api/voice-detection", response_model=VoiceDetectionResponse)
 async def detect_voice(
     request: VoiceDetectionRequest
@@ -78,34 +118,62 @@ async def detect_voice(
             raise ValueError("Only MP3 format is supported.")
 
         # 3. Decode Base64
+        # Size checks return the same 400 as the raw route; the string length is checked
+        # before any decode work, the exact byte count after
+        if len(request.audioBase64) > MAX_BASE64_LENGTH:
+            raise ValueError("Audio payload too large.")
         try:
-            audio_data = base64.b64decode(request.audioBase64)
+            # pybase64 uses SIMD kernels; pass ASCII bytes to skip its str fallback
+            audio_data = await asyncio.to_thread(decode_base64, request.audioBase64.encode("ascii"))
         except Exception:
             raise ValueError("Invalid Base64 encoding.")
             
         if not audio_data:
              raise ValueError("Empty audio data.")
+        if len(audio_data) > MAX_AUDIO_BYTES:
+             raise ValueError("Audio payload too large.")
 
-        # 4. Perform Detection (Non-Blocking)
-        # We run the synchronous detector.analyze_audio in a threadpool
-        # so the API remains responsive to other requests.
-        logger.info(f"Processing request for language: {request.language}")
-        
-        result = await run_in_threadpool(detector.analyze_audio, audio_data, request.language)
-
-        if "error" in result:
-             # If internal analysis failed, we still want to return a strict error format if possible,
-             # or map it to the error response.
-             raise ValueError(result["error"])
-
-        # 5. Return formatted response (Strict JSON)
-        return VoiceDetectionResponse(
-            status="success",
-            language=request.language,
-            classification=result["classification"],
-            confidenceScore=result["confidenceScore"],
-            explanation=result["explanation"]
+        # 4. Perform Detection
+        return await run_detection(audio_data, request.language)
+
+    except ValueError as ve:
+        logger.error(f"Validation Error: {ve}")
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "message": str(ve)}
         )
+    except Exception as e:
+        logger.error(f"Internal Error: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": "Internal server error processing audio."}
+        )
+
+@app.post("/api/voice-detection/raw", response_model=VoiceDetectionResponse)
+async def detect_voice_raw(
+    request: Request,
+    language: str = Query(..., description="Language: Tamil, English, Hindi, Malayalam, Telugu")
+):
+    """Same as /api/voice-detection, but the body is the MP3 itself (application/octet-stream), no base64."""
+    try:
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_AUDIO_BYTES:
+            raise ValueError("Audio payload too large.")
+
+        # Stream the body with a running count so chunked uploads without a Content-Length
+        # are cut off at the limit instead of being buffered in full first
+        chunks, received = [], 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_AUDIO_BYTES:
+                raise ValueError("Audio payload too large.")
+            chunks.append(chunk)
+        audio_data = b"".join(chunks)
+
+        if not audio_data:
+             raise ValueError("Empty audio data.")
+
+        return await run_detection(audio_data, language)
 
     except ValueError as ve:
         logger.error(f"Validation Error: {ve}")
@@ -129,3 +197,11 @@ def health_check():
     }
 
 # Standard execution for HF Spaces (uvicorn launched via Docker CMD)
+# Local runs: uvicorn's "auto" loop/http pick uvloop + httptools when installed (not on Windows)
+if __name__ == "__main__":
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=1
+    )
@@ -1,15 +1,70 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import inspect
 import io
+import os
+import threading
+import blake3
 import librosa
 import numpy as np
 import soundfile as sf
 import torch
+from cachetools import LRUCache
 from transformers import pipeline
 
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+ONNX_DIR = os.getenv("ONNX_DIR", "onnx_models")
+
+# Only the first MAX_AUDIO_SECONDS of each upload is decoded and classified. The detectors
+# are trained on short clips, and this bounds latency/memory regardless of upload length.
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "4"))
+
+# Per-thread scratch space for audio decoding (see AudioDetector._decode_scratch)
+_tls = threading.local()
+
+# Micro-batching: coalesce up to MAX_BATCH requests arriving within MAX_WAIT_MS
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "10"))
+
+# Int8-quantize models flagged with "quantize" when running on CPU (set QUANTIZE=0 to disable)
+QUANTIZE = os.getenv("QUANTIZE", "1") == "1"
+
+# torch.compile models that run through PyTorch (set TORCH_COMPILE=0 to disable)
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "1") == "1"
+
+# Errors that mean torch.compile itself failed (vs. OOM/bad input), so the eager model is safe to use
+try:
+    from torch._dynamo.exc import BackendCompilerFailed, TorchDynamoException
+    COMPILE_ERRORS = (TorchDynamoException, BackendCompilerFailed)
+except ImportError:
+    COMPILE_ERRORS = ()
+
+# Results cached per (audio hash, language) to absorb retries/duplicate uploads
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+
+# Labels that mean "Fake" across the ensemble's heads
+AI_LABELS = {"fake", "spoof", "aivoice", "artificial", "generated"}
+
+class _LogitsOnly(torch.nn.Module):
+    """Wraps an HF classifier so ONNX export sees plain tensor inputs/outputs."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values, attention_mask=None):
+        return self.model(input_values=input_values, attention_mask=attention_mask, return_dict=False)[0]
+
 class AudioDetector:
     def __init__(self):
         print("--- [AudioDetector] Initializing 4-Model Ensemble System... ---")
         
         # The Committee of Experts
+        # Keep the largest model last: it is skipped when the others already decide the verdict
         self.models_config = [
             {
                 "id": "MelodyMachine/Deepfake-audio-detection-V2", 
@@ -29,135 +84,544 @@ class AudioDetector:
             {
                 "id": "Gustking/wav2vec2-large-xlsr-deepfake-audio-classification", 
                 "name": "Gustking-XLSR",
-                "weight": 1.2 # Higher weight for the large model
+                "weight": 1.2, # Higher weight for the large model
+                "quantize": True # ~1GB FP32; int8 Linear layers on CPU
             }
         ]
         
         self.pipelines = []
         
+        # Place the ensemble on GPU (FP16) when available, otherwise CPU (FP32)
+        self.device = 0 if torch.cuda.is_available() else -1
+        self.dtype = torch.float16 if self.device == 0 else torch.float32
+        print(f"--- Inference device: {'cuda:0' if self.device == 0 else 'cpu'} ({self.dtype}) ---")
+        
+        # The ensemble runs its models concurrently, so split the cores between them instead of
+        # letting every model's intra-op pool claim all of them
+        self.threads_per_model = max(1, (os.cpu_count() or 1) // len(self.models_config))
+        torch.set_num_threads(self.threads_per_model)
+        
         for cfg in self.models_config:
             try:
                 print(f"--- Loading Model: {cfg['name']} ({cfg['id']}) ---")
                 # Load pipeline
-                p = pipeline("audio-classification", model=cfg['id'])
-                self.pipelines.append({"pipe": p, "config": cfg})
+                p = pipeline(
+                    "audio-classification",
+                    model=cfg['id'],
+                    device=self.device,
+                    torch_dtype=self.dtype
+                )
+                p.model.eval()
+                # Dedicated CUDA stream so concurrent models don't serialize on the default stream
+                stream = torch.cuda.Stream() if self.device == 0 else None
+                # Dynamic int8 quantization for the large model on CPU deployments
+                quantize = QUANTIZE and self.device == -1 and cfg.get('quantize', False)
+                session = self._build_onnx_session(p, cfg, quantize)
+                if session is None and quantize:
+                    p.model = torch.quantization.quantize_dynamic(p.model, {torch.nn.Linear}, dtype=torch.qint8)
+                    print(f"[+] Quantized {cfg['name']} to int8")
+                # Inductor kernel fusion for models served by PyTorch (compiles lazily during warmup).
+                # Default mode, not "reduce-overhead": CUDA graphs don't mix with our worker threads
+                # and per-model streams, and batch/length shapes vary per request.
+                # When ORT serves the model, the PyTorch weights are not kept: nothing falls back to them
+                eager_model = p.model if session is None else None
+                model = eager_model
+                if session is None and TORCH_COMPILE and hasattr(torch, "compile"):
+                    model = torch.compile(p.model, dynamic=True)
+                self.pipelines.append({
+                    "config": cfg,
+                    "stream": stream,
+                    "session": session,
+                    "session_inputs": {i.name for i in session.get_inputs()} if session is not None else set(),
+                    "fe": p.feature_extractor,
+                    "fe_key": self._feature_extractor_key(p.feature_extractor),
+                    "model": model,
+                    "eager_model": eager_model,
+                    "ai_index": self._find_ai_index(p.model.config.id2label)
+                })
+                del p # drops the pipeline (and the torch weights, if ORT serves this model)
                 print(f"[+] Loaded {cfg['name']}")
             except Exception as e:
                 print(f"[-] Failed to load {cfg['name']}: {e}")
         
         if not self.pipelines:
             print("CRITICAL: No models could be loaded. Ensemble is empty.")
+        if self.device == 0:
+            torch.cuda.empty_cache() # release weights of models now served by ORT
+        
+        # One worker per model so the ensemble runs concurrently
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.pipelines)))
+        
+        # LRU of finished results keyed by (blake3 digest, language); LRUCache isn't thread-safe
+        self.cache = LRUCache(maxsize=RESULT_CACHE_SIZE)
+        self.cache_lock = threading.Lock()
     
-    def analyze_audio(self, audio_data: bytes, language: str):
+    def _build_onnx_session(self, p, cfg, quantize=False):
+        """Exports the classifier to ONNX and opens an ORT session (None -> use the pipeline)."""
+        if ort is None:
+            return None
+        if self.device == 0 and "CUDAExecutionProvider" not in ort.get_available_providers():
+            # CPU-only onnxruntime wheel on a CUDA host: keep the FP16 PyTorch model on the GPU instead
+            print(f"[-] onnxruntime has no CUDA provider, serving {cfg['name']} with PyTorch")
+            return None
+        
         try:
-            # 1. Load Audio
-            buffer = io.BytesIO(audio_data)
-            y, sr = librosa.load(buffer, sr=16000)
+            os.makedirs(ONNX_DIR, exist_ok=True)
+            # Models whose extractor emits an attention mask get it as a graph input, so padded
+            # batches score the same as unpadded clips
+            use_mask = p.feature_extractor.return_attention_mask
+            # Key the cached export on the model revision so updated weights get re-exported
+            revision = (getattr(p.model.config, "_commit_hash", None) or "local")[:12]
+            onnx_path = os.path.join(
+                ONNX_DIR,
+                f"{cfg['name']}-{revision}-{'fp16' if self.device == 0 else 'fp32'}{'-mask' if use_mask else ''}-b2.onnx"
+            )
             
-            # 2. Extract Features (For Explanation Context Only)
-            # We preserve this for generating professional justifications, 
-            # but the DECISION is purely model-based.
-            centroid = np.mean(librosa.feature.spectral_centroid(y=y, sr=sr))
+            if not os.path.exists(onnx_path):
+                # Trace at B=2 so nothing in the graph gets specialized to a batch of one
+                dummy = torch.zeros(2, 16000, dtype=self.dtype, device=p.model.device)
+                args, input_names = (dummy,), ["input_values"]
+                dynamic_axes = {"input_values": {0: "b", 1: "t"}, "logits": {0: "b"}}
+                if use_mask:
+                    args += (torch.ones(2, 16000, dtype=torch.long, device=p.model.device),)
+                    input_names.append("attention_mask")
+                    dynamic_axes["attention_mask"] = {0: "b", 1: "t"}
+                # Export to a temp file and rename, so an interrupted export is never picked up as cached
+                tmp_path = onnx_path + ".tmp"
+                # TorchScript exporter: torch>=2.9 defaults to dynamo, which needs onnxscript and
+                # ignores dynamic_axes
+                export_kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+                torch.onnx.export(
+                    _LogitsOnly(p.model),
+                    args,
+                    tmp_path,
+                    input_names=input_names,
+                    output_names=["logits"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=17,
+                    **export_kwargs
+                )
+                os.replace(tmp_path, onnx_path)
             
-            # 3. Running The Ensemble
-            votes = []
-            total_score = 0
-            total_weight = 0
+            if quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                int8_path = onnx_path.replace(".onnx", "-int8.onnx")
+                if not os.path.exists(int8_path):
+                    # MatMul only (the nn.Linear layers): the CPU provider has no ConvInteger
+                    # kernel for the conv feature encoder / positional conv
+                    tmp_path = int8_path + ".tmp"
+                    quantize_dynamic(onnx_path, tmp_path, op_types_to_quantize=["MatMul"], weight_type=QuantType.QInt8)
+                    os.replace(tmp_path, int8_path)
+                onnx_path = int8_path
             
-            print(f"\n--- Running Ensemble Inference on {len(self.pipelines)} models ---")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = self.threads_per_model
+            # Idle ORT workers would otherwise busy-wait on cores the other models need
+            options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+            providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if self.device == 0 else ["CPUExecutionProvider"]
+            session = ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
             
-            for item in self.pipelines:
-                p = item['pipe']
-                cfg = item['config']
-                weight = cfg['weight']
-                
-                try:
-                    # Run Inference
-                    results = p(y, top_k=None) # Get all labels
-                    
-                    # Parsing Result for AI Probability
-                    ai_score = 0.0
-                    
-                    # Logic: Find the label that means "Fake"
-                    ai_labels = ["fake", "spoof", "aivoice", "artificial", "generated"]
-                    
-                    found = False
-                    for r in results:
-                        label_clean = r['label'].lower().strip()
-                        if label_clean in ai_labels:
-                            ai_score = r['score']
-                            found = True
-                            break
-                            
-                    # Note: If no AI label is found (e.g. only 'real'/'human'), ai_score stays 0.0 (Human)
-                    # This logic covers {0: 'real', 1: 'fake'} where 'fake' is present.
-                    
-                    verdict = "AI" if ai_score > 0.5 else "HUMAN"
-                    
-                    # Weighted contribution
-                    votes.append({
-                        "name": cfg['name'],
-                        "ai_prob": ai_score,
-                        "verdict": verdict
-                    })
-                    
-                    total_score += (ai_score * weight)
-                    total_weight += weight
-                    
-                    print(f" > {cfg['name']}: {ai_score:.4f} ({verdict})")
-                    
-                except Exception as e:
-                    print(f"Error inferencing {cfg['name']}: {e}")
-            
-            # 4. Final Aggregation
-            if total_weight > 0:
-                final_ensemble_score = total_score / total_weight
+            # Smoke-test a padded B=2 batch of different length than the trace before trusting the session
+            session_inputs = {i.name for i in session.get_inputs()}
+            feed = {"input_values": np.zeros((2, 8000), dtype=np.float16 if self.device == 0 else np.float32)}
+            if "attention_mask" in session_inputs:
+                feed["attention_mask"] = np.ones((2, 8000), dtype=np.int64)
+            logits = session.run(["logits"], feed)[0]
+            if logits.shape != (2, p.model.config.num_labels):
+                raise RuntimeError(f"unexpected batched output shape {logits.shape}")
+            
+            print(f"[+] ONNX Runtime session ready for {cfg['name']}")
+            return session
+        except Exception as e:
+            print(f"[-] ONNX export failed for {cfg['name']}, using PyTorch pipeline: {e}")
+            return None
+    
+    @staticmethod
+    def _find_ai_index(id2label):
+        """Resolves the class index meaning "Fake" once per model (None if the model has none)."""
+        for idx, label in id2label.items():
+            if label.lower().strip() in AI_LABELS:
+                return int(idx)
+        return None
+    
+    @staticmethod
+    def _feature_extractor_key(fe):
+        """Hashable summary of an extractor's config; equal keys produce identical features."""
+        config = fe.to_dict()
+        config.pop("processor_class", None)
+        return repr(sorted(config.items()))
+    
+    def _extract_features(self, waveforms):
+        """Runs each distinct feature extractor once per padding group, keyed by fe_key.
+        
+        Returns {fe_key: [(rows, inputs), ...]}. Extractors that emit an attention mask pad the
+        whole batch as one group. Extractors without one would normalize over (and the model
+        would attend to) padded zeros, so they get one group per clip length and never pad.
+        """
+        features = {}
+        for item in self.pipelines:
+            if item['fe_key'] in features:
+                continue
+            
+            if item['fe'].return_attention_mask:
+                groups = [list(range(len(waveforms)))]
             else:
-                final_ensemble_score = 0.0 # Fail safe
-                
-            is_ai = final_ensemble_score > 0.5
-            final_classification = "AI_GENERATED" if is_ai else "HUMAN"
+                by_length = {}
+                for i, y in enumerate(waveforms):
+                    by_length.setdefault(len(y), []).append(i)
+                groups = list(by_length.values())
             
-            # Confidence Score: Distance from 0.5, normalized to 0.5-1.0 roughly, 
-            # or just probability of the winning class.
-            class_confidence = final_ensemble_score if is_ai else (1.0 - final_ensemble_score)
+            features[item['fe_key']] = []
+            for rows in groups:
+                inputs = item['fe']([waveforms[i] for i in rows], sampling_rate=16000, return_tensors='np', padding='longest')
+                features[item['fe_key']].append((rows, {
+                    "input_values": inputs['input_values'].astype(np.float32),
+                    "attention_mask": inputs.get('attention_mask')
+                }))
+        return features
+    
+    def _run_session(self, item, inputs):
+        """Runs the ORT session and returns class probabilities of shape [B, C]."""
+        feed = {"input_values": inputs['input_values'].astype(np.float16 if self.device == 0 else np.float32)}
+        if inputs['attention_mask'] is not None and "attention_mask" in item['session_inputs']:
+            feed["attention_mask"] = inputs['attention_mask'].astype(np.int64)
+        
+        logits = item['session'].run(["logits"], feed)[0].astype(np.float32)
+        probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return probs / probs.sum(axis=-1, keepdims=True)
+    
+    @staticmethod
+    def _to_device(array, device):
+        """Moves a numpy array to device; on CUDA via pinned memory so the H2D copy is async."""
+        tensor = torch.from_numpy(array)
+        if device.type == "cuda":
+            return tensor.pin_memory().to(device, non_blocking=True)
+        return tensor.to(device)
+    
+    def _run_torch(self, item, inputs):
+        """Runs the PyTorch model directly (bypassing the pipeline) and returns class probabilities of shape [B, C]."""
+        model = item['model']
+        with torch.inference_mode():
+            kwargs = {"input_values": self._to_device(inputs['input_values'], model.device).to(self.dtype)}
+            if inputs['attention_mask'] is not None:
+                kwargs["attention_mask"] = self._to_device(inputs['attention_mask'], model.device)
+            try:
+                logits = model(**kwargs).logits
+            except COMPILE_ERRORS as e:
+                eager = item['eager_model']
+                if model is eager:
+                    raise
+                # torch.compile failed (e.g. recompiling for a new shape); serve this model eagerly from now on
+                print(f"[-] torch.compile failed for {item['config']['name']}, using eager model: {e}")
+                item['model'] = eager
+                logits = eager(**kwargs).logits
+            return logits.float().softmax(-1).cpu().numpy()
+    
+    @staticmethod
+    def _decode_scratch(size: int):
+        """Per-thread float32 decode buffer, grown on demand and reused across requests."""
+        buf = getattr(_tls, 'decode_buf', None)
+        if buf is None or buf.size < size:
+            buf = _tls.decode_buf = np.empty(size, dtype=np.float32)
+        return buf
+    
+    def _load_audio(self, audio_data: bytes, target_sr: int = 16000):
+        """Decodes the first MAX_AUDIO_SECONDS of MP3 bytes to mono float32 at target_sr."""
+        try:
+            # Fast path: libsndfile (>=1.1) decodes MP3 in-process, SoXR resamples
+            with sf.SoundFile(io.BytesIO(audio_data)) as f:
+                native_sr = f.samplerate
+                frames = int(MAX_AUDIO_SECONDS * native_sr)
+                if f.frames > 0:
+                    frames = min(frames, f.frames)
+                # Decode into the thread's scratch buffer instead of a fresh allocation
+                scratch = self._decode_scratch(frames * f.channels)
+                out = scratch[:frames * f.channels].reshape(frames, f.channels)
+                data = f.read(dtype='float32', always_2d=True, out=out)
+            data = data.mean(axis=1) if data.shape[1] > 1 else data[:, 0]
+            if native_sr != target_sr:
+                data = librosa.resample(data, orig_sr=native_sr, target_sr=target_sr, res_type='soxr_hq')
+            data = data[:int(MAX_AUDIO_SECONDS * target_sr)]
+            # The waveform outlives this call (batch queue, explanation), so it must not alias scratch
+            if np.shares_memory(data, scratch):
+                data = data.copy()
+            return data, target_sr
+        except Exception as e:
+            # Fallback: librosa/audioread (slower, but handles anything ffmpeg can)
+            print(f"soundfile decode failed ({e}), falling back to librosa.load")
+            buffer = io.BytesIO(audio_data)
+            return librosa.load(buffer, sr=target_sr, duration=MAX_AUDIO_SECONDS)
+    
+    def _run_model(self, item, inputs):
+        """Runs a single ensemble member on a batch and returns one vote per row (None on failure)."""
+        cfg = item['config']
+        
+        try:
+            # Run Inference: ONNX Runtime if exported, else the model on its own CUDA stream
+            if item['session'] is not None:
+                probs = self._run_session(item, inputs)
+            elif item['stream'] is not None:
+                with torch.cuda.stream(item['stream']):
+                    probs = self._run_torch(item, inputs)
+            else:
+                probs = self._run_torch(item, inputs)
             
-            print(f"--- Final Ensemble Score: {final_ensemble_score:.4f} => {final_classification} (Conf: {class_confidence:.2f}) ---\n")
-
-            # 5. Construct Explanation
-            # "3 out of 4 models detected deepfake artifacts..."
-            ai_votes_count = sum(1 for v in votes if v['verdict'] == 'AI')
-            total_models = len(votes)
+            # Column read over the whole batch; no per-label Python objects
+            # Note: If the model has no AI label (e.g. only 'real'/'human'), ai_score is 0.0 (Human)
+            if item['ai_index'] is not None:
+                ai_scores = probs[:, item['ai_index']]
+            else:
+                ai_scores = np.zeros(len(probs), dtype=np.float32)
+            is_ai = ai_scores > 0.5
+            
+            votes = []
+            for ai_score, flagged in zip(ai_scores.tolist(), is_ai.tolist()):
+                verdict = "AI" if flagged else "HUMAN"
+                
+                print(f" > {cfg['name']}: {ai_score:.4f} ({verdict})")
+                
+                votes.append({
+                    "name": cfg['name'],
+                    "ai_prob": ai_score,
+                    "verdict": verdict,
+                    "weight": cfg['weight']
+                })
+            return votes
             
-            explanations = []
-            explanations.append(f"Ensemble Analysis: {ai_votes_count}/{total_models} models flagged this audio as AI-generated.")
-            explanations.append(f"Aggregated Score: {final_ensemble_score*100:.1f}%.")
+        except Exception as e:
+            print(f"Error inferencing {cfg['name']}: {e}")
+            return None
+    
+    def _run_models(self, items, features, rows, batch_votes, batch_failed):
+        """Runs `items` concurrently on the batch rows in `rows`, appending votes into batch_votes.
+        
+        Rows whose model run failed are flagged in batch_failed.
+        """
+        wanted = set(rows)
+        
+        # Dispatch all (model, padding group) pairs at once; PyTorch releases the GIL so they overlap
+        futures = {}
+        for item in items:
+            for group_rows, inputs in features[item['fe_key']]:
+                picked = [j for j, row in enumerate(group_rows) if row in wanted]
+                if not picked:
+                    continue
+                if len(picked) != len(group_rows):
+                    inputs = {k: (v[picked] if v is not None else None) for k, v in inputs.items()}
+                future = self.executor.submit(self._run_model, item, inputs)
+                futures[future] = [group_rows[j] for j in picked]
+        
+        for future in concurrent.futures.as_completed(futures):
+            model_votes = future.result()
+            if model_votes is None:
+                for row in futures[future]:
+                    batch_failed[row] = True
+                continue
+            for row, vote in zip(futures[future], model_votes):
+                batch_votes[row].append(vote)
+    
+    @staticmethod
+    def _is_decided(votes, remaining_weight):
+        """True if no outcome of the remaining models can flip the AI/HUMAN verdict."""
+        score = sum(v['ai_prob'] * v['weight'] for v in votes)
+        weight = sum(v['weight'] for v in votes)
+        if weight + remaining_weight == 0:
+            return False
+        
+        # Bounds on the final score if every remaining model votes 0.0 or 1.0
+        worst = score / (weight + remaining_weight)
+        best = (score + remaining_weight) / (weight + remaining_weight)
+        return (worst > 0.5) == (best > 0.5)
+    
+    def _infer_batch(self, waveforms, early_exit=True):
+        """Runs the ensemble over a batch of waveforms; returns (votes, complete) per waveform.
+        
+        `complete` is False if any model that should have scored the clip failed.
+        
+        With early_exit, the last (largest) model only runs on clips whose verdict it could still flip.
+        """
+        print(f"\n--- Running Ensemble Inference on {len(self.pipelines)} models (batch={len(waveforms)}) ---")
+        
+        # Preprocess once per distinct feature extractor and share across models
+        features = self._extract_features(waveforms)
+        
+        batch_votes = [[] for _ in waveforms]
+        batch_failed = [not self.pipelines for _ in waveforms]
+        rows = list(range(len(waveforms)))
+        
+        if not early_exit or len(self.pipelines) < 2:
+            self._run_models(self.pipelines, features, rows, batch_votes, batch_failed)
+        else:
+            cheap, last = self.pipelines[:-1], self.pipelines[-1]
+            self._run_models(cheap, features, rows, batch_votes, batch_failed)
             
-            if is_ai:
-                 if centroid > 2000:
-                     explanations.append("High-frequency spectral artifacts consistent with neural vocoders detected.")
-                 else:
-                     explanations.append("Deep learning pattern matching identified non-biological features.")
+            undecided = [i for i in rows if not self._is_decided(batch_votes[i], last['config']['weight'])]
+            if undecided:
+                self._run_models([last], features, undecided, batch_votes, batch_failed)
             else:
-                 explanations.append("Acoustic analysis confirms natural vocal resonance and organic production.")
+                print(f" > {last['config']['name']}: skipped (verdict already decided)")
+        return [(votes, not failed) for votes, failed in zip(batch_votes, batch_failed)]
+    
+    def _build_result(self, y, sr, votes):
+        """Aggregates the ensemble votes for one clip into the API response dict."""
+        # Weighted contribution
+        total_score = sum(v['ai_prob'] * v['weight'] for v in votes)
+        total_weight = sum(v['weight'] for v in votes)
+        
+        # Final Aggregation
+        if total_weight > 0:
+            final_ensemble_score = total_score / total_weight
+        else:
+            final_ensemble_score = 0.0 # Fail safe
             
-            final_explanation = " ".join(explanations)
+        is_ai = final_ensemble_score > 0.5
+        final_classification = "AI_GENERATED" if is_ai else "HUMAN"
+        
+        # Confidence Score: Distance from 0.5, normalized to 0.5-1.0 roughly, 
+        # or just probability of the winning class.
+        class_confidence = final_ensemble_score if is_ai else (1.0 - final_ensemble_score)
+        
+        print(f"--- Final Ensemble Score: {final_ensemble_score:.4f} => {final_classification} (Conf: {class_confidence:.2f}) ---\n")
 
-            return {
-                "classification": final_classification,
-                # Return logical confidence (prob of the chosen class)
-                "confidenceScore": round(float(class_confidence), 2),
-                "explanation": final_explanation
-            }
+        # Construct Explanation
+        # "3 out of 4 models detected deepfake artifacts..."
+        ai_votes_count = sum(1 for v in votes if v['verdict'] == 'AI')
+        total_models = len(votes)
+        
+        explanations = []
+        explanations.append(f"Ensemble Analysis: {ai_votes_count}/{total_models} models flagged this audio as AI-generated.")
+        explanations.append(f"Aggregated Score: {final_ensemble_score*100:.1f}%.")
+        
+        if is_ai:
+             # Spectral centroid is for explanation context only (the DECISION is purely
+             # model-based), so the STFT runs only here and over the first 2 seconds.
+             centroid = float(np.mean(librosa.feature.spectral_centroid(y=y[:2 * sr], sr=sr)))
+             if centroid > 2000:
+                 explanations.append("High-frequency spectral artifacts consistent with neural vocoders detected.")
+             else:
+                 explanations.append("Deep learning pattern matching identified non-biological features.")
+        else:
+             explanations.append("Acoustic analysis confirms natural vocal resonance and organic production.")
+        
+        final_explanation = " ".join(explanations)
+
+        return {
+            "classification": final_classification,
+            # Return logical confidence (prob of the chosen class)
+            "confidenceScore": round(float(class_confidence), 2),
+            "explanation": final_explanation
+        }
+    
+    @staticmethod
+    def _error_result(e):
+        """Fail-safe response used when decoding or inference raises."""
+        print(f"Analysis Failed: {e}")
+        return {
+            "classification": "HUMAN", # Fail safe
+            "confidenceScore": 0.0,
+            "error": str(e),
+            "explanation": "Analysis failed due to internal error."
+        }
+    
+    def warmup(self):
+        """Runs one silent forward pass per model, skipping MP3 decode and spectral analysis.
+        
+        This also triggers torch.compile off the request path.
+        """
+        # Full-length clips at B=2 so compiled graphs come out dynamic in batch and time
+        # (size-1 dims get specialized), then B=1 for the common single-request batch
+        silence = np.zeros(int(MAX_AUDIO_SECONDS * 16000), dtype=np.float32)
+        self._infer_batch([silence, silence], early_exit=False)
+        self._infer_batch([silence], early_exit=False)
+    
+    @staticmethod
+    def _cache_key(audio_data: bytes, language: str):
+        return (blake3.blake3(audio_data).digest(), language)
+    
+    def _cache_get(self, key):
+        with self.cache_lock:
+            result = self.cache.get(key)
+        return dict(result) if result is not None else None
+    
+    def _cache_put(self, key, result):
+        with self.cache_lock:
+            self.cache[key] = dict(result)
+    
+    # --- Micro-batching (async API) ---
+    
+    def start_batcher(self, slots: asyncio.Semaphore):
+        """Starts the background task that coalesces concurrent requests into one forward pass.
+        
+        `slots` bounds how many batches may be running on the device at once.
+        """
+        self.queue = asyncio.Queue()
+        self.batch_tasks = set()
+        self.batcher_task = asyncio.create_task(self._batcher_loop(slots))
+    
+    async def stop_batcher(self):
+        self.batcher_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.batcher_task
+    
+    async def _batcher_loop(self, slots: asyncio.Semaphore):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
             
+            # Gather more requests until the batch is full or the wait window closes
+            deadline = loop.time() + MAX_WAIT_MS / 1000
+            while len(batch) < MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            await slots.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self.batch_tasks.add(task) # hold a reference until the batch finishes
+            task.add_done_callback(self.batch_tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+    
+    async def _run_batch(self, batch):
+        try:
+            results = await asyncio.to_thread(self._infer_batch, [y for y, _ in batch])
+            for (_, future), votes in zip(batch, results):
+                if not future.done():
+                    future.set_result(votes)
         except Exception as e:
-            print(f"Analysis Failed: {e}")
-            return {
-                "classification": "HUMAN", # Fail safe
-                "confidenceScore": 0.0,
-                "error": str(e),
-                "explanation": "Analysis failed due to internal error."
-            }
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    async def analyze_audio_batched(self, audio_data: bytes, language: str):
+        """Async analysis; inference is batched with other in-flight requests by the batcher task."""
+        try:
+            key = await asyncio.to_thread(self._cache_key, audio_data, language)
+            cached = self._cache_get(key)
+            if cached is not None:
+                print("--- Cache hit: returning previous result ---")
+                return cached
+            
+            y, sr = await asyncio.to_thread(self._load_audio, audio_data)
+            
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((y, future))
+            votes, complete = await future
+            
+            if not votes:
+                raise RuntimeError("All ensemble models failed to score the audio.")
+            
+            result = await asyncio.to_thread(self._build_result, y, sr, votes)
+            # Only cache full-strength verdicts; a transient model failure must not stick
+            if complete:
+                self._cache_put(key, result)
+            return result
+        except Exception as e:
+            return self._error_result(e)
 
 # Global Instance
 detector = AudioDetector()